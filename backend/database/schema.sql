@@ -121,6 +121,30 @@ CREATE TABLE company_problems (
 CREATE INDEX idx_company_problems_company ON company_problems(company_slug);
 CREATE INDEX idx_company_problems_frequency ON company_problems(frequency DESC);
 
+-- Content hashes of ingested CSV files (scripts/ingest_problems.py --incremental)
+CREATE TABLE ingest_manifest (
+    path TEXT PRIMARY KEY, -- 'google/all.csv'
+    company_slug VARCHAR(100) NOT NULL,
+    time_period VARCHAR(50) NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    ingested_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Problem counts maintained by triggers (see TRIGGERS & FUNCTIONS), so stats
+-- reads never scan problems or company_problems
+CREATE TABLE problem_stats (
+    difficulty VARCHAR(20) PRIMARY KEY,
+    problems INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE company_problem_stats (
+    company_slug VARCHAR(100) NOT NULL,
+    time_period VARCHAR(50) NOT NULL,
+    company_name VARCHAR(100),
+    problems INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (company_slug, time_period)
+);
+
 -- ============================================
 -- SERVICE: ACTIVITY LOG (For Green Chart)
 -- ============================================
@@ -206,6 +230,7 @@ CREATE TABLE jobs (
     ai_interview_enabled BOOLEAN DEFAULT TRUE,
     problem_pool UUID[], -- Array of problem IDs for this job
     interview_duration_mins INT DEFAULT 45,
+    scoring_weights JSONB, -- Score weight profile overrides (see WeightProfile in interview_engine.py)
     
     status VARCHAR(20) DEFAULT 'draft', -- 'draft', 'open', 'paused', 'closed'
     applications_count INT DEFAULT 0,
@@ -477,6 +502,92 @@ $$ language 'plpgsql';
 CREATE TRIGGER update_streak_on_activity AFTER INSERT ON activity_log
     FOR EACH ROW EXECUTE FUNCTION update_user_streak();
 
+-- Statement-level triggers applying each statement's changed rows (transition
+-- tables) to problem_stats and company_problem_stats
+CREATE OR REPLACE FUNCTION apply_problem_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO problem_stats (difficulty, problems)
+        SELECT difficulty, COUNT(*) FROM new_rows GROUP BY difficulty
+        ON CONFLICT (difficulty) DO UPDATE SET problems = problem_stats.problems + EXCLUDED.problems;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO problem_stats (difficulty, problems)
+        SELECT difficulty, -COUNT(*) FROM old_rows GROUP BY difficulty
+        ON CONFLICT (difficulty) DO UPDATE SET problems = problem_stats.problems + EXCLUDED.problems;
+    ELSE
+        -- Only a changed difficulty moves a problem between rows
+        INSERT INTO problem_stats (difficulty, problems)
+        SELECT difficulty, SUM(delta) FROM (
+            SELECT difficulty, 1 AS delta FROM new_rows
+            UNION ALL
+            SELECT difficulty, -1 FROM old_rows
+        ) d
+        GROUP BY difficulty
+        HAVING SUM(delta) <> 0
+        ON CONFLICT (difficulty) DO UPDATE SET problems = problem_stats.problems + EXCLUDED.problems;
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION apply_company_problem_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO company_problem_stats (company_slug, time_period, company_name, problems)
+        SELECT company_slug, time_period, MAX(company_name), COUNT(*)
+        FROM new_rows GROUP BY company_slug, time_period
+        ON CONFLICT (company_slug, time_period) DO UPDATE SET
+            company_name = EXCLUDED.company_name,
+            problems = company_problem_stats.problems + EXCLUDED.problems;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO company_problem_stats (company_slug, time_period, company_name, problems)
+        SELECT company_slug, time_period, MAX(company_name), -COUNT(*)
+        FROM old_rows GROUP BY company_slug, time_period
+        ON CONFLICT (company_slug, time_period) DO UPDATE SET
+            problems = company_problem_stats.problems + EXCLUDED.problems;
+    ELSE
+        -- Frequency updates leave counts alone but may rename the company
+        INSERT INTO company_problem_stats (company_slug, time_period, company_name, problems)
+        SELECT company_slug, time_period, MAX(company_name) FILTER (WHERE delta > 0), SUM(delta) FROM (
+            SELECT company_slug, time_period, company_name, 1 AS delta FROM new_rows
+            UNION ALL
+            SELECT company_slug, time_period, company_name, -1 FROM old_rows
+        ) d
+        GROUP BY company_slug, time_period
+        ON CONFLICT (company_slug, time_period) DO UPDATE SET
+            company_name = COALESCE(EXCLUDED.company_name, company_problem_stats.company_name),
+            problems = company_problem_stats.problems + EXCLUDED.problems;
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER problem_stats_insert AFTER INSERT ON problems
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_problem_stats();
+
+CREATE TRIGGER problem_stats_update AFTER UPDATE ON problems
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_problem_stats();
+
+CREATE TRIGGER problem_stats_delete AFTER DELETE ON problems
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_problem_stats();
+
+CREATE TRIGGER company_problem_stats_insert AFTER INSERT ON company_problems
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_company_problem_stats();
+
+CREATE TRIGGER company_problem_stats_update AFTER UPDATE ON company_problems
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_company_problem_stats();
+
+CREATE TRIGGER company_problem_stats_delete AFTER DELETE ON company_problems
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_company_problem_stats();
+
 -- ============================================
 -- SEED DATA: Initial Admin User
 -- ============================================
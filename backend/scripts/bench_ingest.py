@@ -0,0 +1,211 @@
+"""
+Problem Ingestion Benchmark
+===========================
+Times the stages of ingest_problems.py on a dataset tree, either an
+existing one or one made with generate_synthetic_dataset.py, and reports
+rows/s and peak RSS for each stage.
+
+Each stage runs in a new interpreter, so its peak RSS (ru_maxrss) is its
+own. Database stages need --db-url and TRUNCATE the problem tables (and
+everything referencing them) first, so point it at a scratch database.
+Results are printed and, with --output, appended as one JSON line per run.
+
+Usage:
+    python bench_ingest.py --generate /tmp/synthetic --companies 2000 --problems 10000
+    python bench_ingest.py --questions-dir ../../leetcode-companywise-interview-questions \\
+        --db-url postgresql://postgres@localhost:5432/bench --modes bulk stream --output ingest.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import contextlib
+import subprocess
+from datetime import datetime
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPTS_DIR)
+
+from ingest_problems import ProblemIngester, company_csv_files, export_to_json, write_snapshot  # noqa: E402
+from generate_synthetic_dataset import PERIOD_FILES, generate  # noqa: E402
+
+FILE_STAGES = ['scan', 'parse', 'parse_merge', 'export_json', 'export_snapshot']
+LOAD_MODES = ['rows', 'bulk', 'stream']
+
+
+async def reset_database(ingester: ProblemIngester):
+    await ingester.ensure_stats_tables()
+    await ingester.ensure_manifest_table()
+    await ingester.pool.execute("""
+        TRUNCATE problems, company_problems, ingest_manifest,
+                 problem_stats, company_problem_stats CASCADE
+    """)
+
+
+async def run_db_stage(stage: str, ingester: ProblemIngester, workers: int, loaders: int) -> tuple:
+    """Time one database stage; returns (seconds, rows)"""
+    if stage == 'incremental':
+        # The first run records every file; the timed one finds nothing changed
+        await ingester.run_incremental()
+        started = time.perf_counter()
+        await ingester.run_incremental()
+        return time.perf_counter() - started, len(ingester.file_manifest())
+
+    await ingester.connect_db(max_size=max(10, loaders + 1))
+    try:
+        if stage.startswith('load_'):
+            await reset_database(ingester)
+            mode = stage[len('load_'):]
+            if mode == 'stream':
+                started = time.perf_counter()
+                await ingester.stream_load(loaders)
+                seconds = time.perf_counter() - started
+                return seconds, await ingester.pool.fetchval("SELECT COUNT(*) FROM company_problems")
+
+            # Parsing is timed by parse_merge; only the load is timed here
+            ingester.scan_companies(workers)
+            started = time.perf_counter()
+            if mode == 'bulk':
+                await ingester.bulk_load()
+            else:
+                await ingester.insert_company_problems(await ingester.insert_problems())
+            return time.perf_counter() - started, len(ingester.company_problems)
+
+        if stage == 'stats':
+            started = time.perf_counter()
+            await ingester.generate_stats()
+            return time.perf_counter() - started, 0
+
+        raise ValueError(f"Unknown stage {stage}")
+    finally:
+        await ingester.close_db()
+
+
+def run_stage(args) -> dict:
+    """Run a single stage in this process and measure it"""
+    ingester = ProblemIngester(args.questions_dir, args.db_url or "")
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if args.stage == 'scan':
+            started = time.perf_counter()
+            rows = sum(len(company_csv_files(ingester.questions_dir / slug)) for slug in ingester.company_slugs())
+            seconds = time.perf_counter() - started
+        elif args.stage == 'parse':
+            started = time.perf_counter()
+            rows = 0
+            for slug in ingester.company_slugs():
+                for csv_file in company_csv_files(ingester.questions_dir / slug):
+                    rows += sum(1 for _ in ingester.read_csv_rows(csv_file))
+            seconds = time.perf_counter() - started
+        elif args.stage == 'parse_merge':
+            started = time.perf_counter()
+            ingester.scan_companies(args.workers)
+            seconds = time.perf_counter() - started
+            rows = len(ingester.company_problems)
+        elif args.stage in ('export_json', 'export_snapshot'):
+            with tempfile.TemporaryDirectory() as tmp:
+                started = time.perf_counter()
+                if args.stage == 'export_json':
+                    export_to_json(args.questions_dir, os.path.join(tmp, 'problems.json'), args.workers)
+                    rows = 0
+                else:
+                    ingester.scan_companies(args.workers)
+                    write_snapshot(ingester, os.path.join(tmp, 'problems.snap'))
+                    rows = len(ingester.company_problems)
+                seconds = time.perf_counter() - started
+        else:
+            seconds, rows = asyncio.run(run_db_stage(args.stage, ingester, args.workers, args.loaders))
+
+    return {
+        'seconds': round(seconds, 4),
+        'rows': rows,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def measure(stage: str, args) -> dict:
+    command = [
+        sys.executable, os.path.abspath(__file__), '--stage', stage,
+        '--questions-dir', args.questions_dir,
+        '--workers', str(args.workers), '--loaders', str(args.loaders)
+    ]
+    if args.db_url:
+        command += ['--db-url', args.db_url]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the problem ingestion stages")
+    parser.add_argument('--questions-dir', help='Dataset to ingest (or use --generate)')
+    parser.add_argument('--generate', metavar='DIR', help='Generate a synthetic dataset into DIR first')
+    parser.add_argument('--companies', type=int, default=1000)
+    parser.add_argument('--problems', type=int, default=5000)
+    parser.add_argument('--rows-per-company', type=int, default=60)
+    parser.add_argument('--overlap', type=float, default=0.5)
+    parser.add_argument('--periods', nargs='+', default=PERIOD_FILES, choices=PERIOD_FILES)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db-url', help='Scratch database for the load stages (its problem tables are truncated)')
+    parser.add_argument('--modes', nargs='+', default=LOAD_MODES, choices=LOAD_MODES)
+    parser.add_argument('--workers', type=int, default=1, help='Parse processes, as in ingest_problems.py')
+    parser.add_argument('--loaders', type=int, default=4, help='Loader connections for --stream')
+    parser.add_argument('--runs', type=int, default=1, help='Runs per stage; the fastest is reported')
+    parser.add_argument('--output', help='Append results as JSON lines to this file')
+    parser.add_argument('--stage', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        print(json.dumps(run_stage(args)))
+        return
+
+    dataset = {}
+    if args.generate:
+        print(f"\n🧪 Generating synthetic dataset in {args.generate}")
+        dataset = generate(args.generate, args.companies, args.problems, args.rows_per_company,
+                           args.overlap, args.periods, args.seed)
+        args.questions_dir = args.generate
+    if not args.questions_dir:
+        parser.error("--questions-dir or --generate is required")
+    dataset['path'] = os.path.abspath(args.questions_dir)
+
+    stages = list(FILE_STAGES)
+    if args.db_url:
+        stages += [f"load_{mode}" for mode in args.modes] + ['stats', 'incremental']
+
+    result = {
+        'timestamp': datetime.utcnow().isoformat(),
+        'python': sys.version.split()[0],
+        'dataset': dataset,
+        'workers': args.workers,
+        'loaders': args.loaders,
+        'stages': {}
+    }
+
+    print(f"\n⏱️  {'stage':<16}{'seconds':>10}{'rows':>10}{'rows/s':>12}{'peak RSS':>12}")
+    for stage in stages:
+        runs = [measure(stage, args) for _ in range(args.runs)]
+        best = min(runs, key=lambda run: run['seconds'])
+        best['rows_per_s'] = round(best['rows'] / best['seconds']) if best['rows'] and best['seconds'] else None
+        result['stages'][stage] = best
+        rate = f"{best['rows_per_s']:,}" if best['rows_per_s'] else '-'
+        print(f"   {stage:<16}{best['seconds']:>10.3f}{best['rows']:>10}{rate:>12}{best['peak_rss_mb']:>9.1f} MB")
+
+    stages_done = result['stages']
+    if 'parse' in stages_done and 'parse_merge' in stages_done:
+        merge = max(0.0, stages_done['parse_merge']['seconds'] - stages_done['parse']['seconds'])
+        result['merge_seconds'] = round(merge, 4)
+        print(f"   {'(merge)':<16}{merge:>10.3f}")
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + "\n")
+        print(f"\n📝 Appended results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
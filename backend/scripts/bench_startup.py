@@ -0,0 +1,116 @@
+"""
+Interview Engine Startup Benchmark
+==================================
+Measures how long the interview engine takes to import and how long a
+freshly launched engine takes to report ready on /health/ready.
+
+Each measurement runs in a new interpreter, so nothing is shared between
+runs. Results are printed and, with --output, appended as one JSON line
+per run so they can be tracked over time.
+
+Usage:
+    python bench_startup.py --runs 5 --workers 1 2 --output startup.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent / "services"
+
+IMPORT_SNIPPET = """
+import sys, time
+started = time.perf_counter()
+import interview_engine
+print(time.perf_counter() - started, 'google.generativeai' in sys.modules)
+"""
+
+
+def engine_env() -> dict:
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "benchmark")
+    # Keep the benchmark independent of external services
+    for name in ("DATABASE_URL", "DEEPGRAM_API_KEY", "STT_URL", "SESSION_CHECKPOINT_DIR", "TTS_PROVIDER"):
+        env.pop(name, None)
+    return env
+
+
+def measure_import() -> tuple:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        cwd=SERVICES_DIR, env=engine_env(), capture_output=True, text=True, check=True
+    ).stdout.split()
+    return float(output[0]), output[1] == "True"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_ready(workers: int, timeout: float) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "interview_engine.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=SERVICES_DIR, env=engine_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health/ready", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                pass
+            time.sleep(0.01)
+        raise TimeoutError(f"Engine not ready after {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark interview engine import time and time to ready")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1])
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', help='Append results as JSON lines to this file')
+    args = parser.parse_args()
+
+    print("\n⏱️  Import time")
+    imports = [measure_import() for _ in range(args.runs)]
+    import_times = [seconds for seconds, _ in imports]
+    result = {
+        'timestamp': datetime.utcnow().isoformat(),
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'import_seconds': round(statistics.median(import_times), 4),
+        'sdk_imported_eagerly': any(eager for _, eager in imports),
+        'ready_seconds': {}
+    }
+    print(f"   median {result['import_seconds']:.3f}s (SDK imported at import time: {result['sdk_imported_eagerly']})")
+
+    for workers in args.workers:
+        print(f"\n🚀 Time to ready with {workers} worker(s)")
+        times = [measure_ready(workers, args.timeout) for _ in range(args.runs)]
+        result['ready_seconds'][str(workers)] = round(statistics.median(times), 4)
+        print(f"   median {statistics.median(times):.3f}s (min {min(times):.3f}s, max {max(times):.3f}s)")
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + "\n")
+        print(f"\n📝 Appended results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Synthetic Problem Dataset Generator
+===================================
+Writes a folder tree shaped like leetcode-companywise-interview-questions
+(one folder per company, one CSV per time period) for benchmarking and
+testing the ingestion script at sizes the real dataset does not reach.
+
+Each company draws its problems from a shared catalog. With --overlap, that
+fraction of draws comes from the most popular tenth of the catalog, so
+popular problems carry many company tags, as in the real data. Shorter time
+periods hold nested subsets of all.csv, and more-than-six-months holds the
+rest.
+
+Usage:
+    python generate_synthetic_dataset.py --output /tmp/synthetic --companies 5000 --problems 20000
+"""
+
+import csv
+import random
+import shutil
+import argparse
+from pathlib import Path
+
+HEADER = ['ID', 'URL', 'Title', 'Difficulty', 'Acceptance %', 'Frequency %']
+DIFFICULTIES = ['Easy', 'Medium', 'Hard']
+
+# File name -> share of the company's problems asked in that period
+PERIOD_SHARES = {
+    'thirty-days.csv': 0.1,
+    'three-months.csv': 0.25,
+    'six-months.csv': 0.5,
+}
+PERIOD_FILES = ['thirty-days.csv', 'three-months.csv', 'six-months.csv', 'more-than-six-months.csv', 'all.csv']
+
+
+def build_catalog(rng: random.Random, problems: int) -> list:
+    """(id, url, title, difficulty, acceptance) for every synthetic problem"""
+    catalog = []
+    for leetcode_id in range(1, problems + 1):
+        slug = f"synthetic-problem-{leetcode_id}"
+        catalog.append((
+            leetcode_id,
+            f"https://leetcode.com/problems/{slug}",
+            f"Synthetic Problem {leetcode_id}",
+            rng.choices(DIFFICULTIES, weights=[25, 52, 23])[0],
+            f"{rng.uniform(15, 90):.1f}%"
+        ))
+    return catalog
+
+
+def write_company(folder: Path, rows: list, periods: list):
+    folder.mkdir(parents=True)
+    # rows are sorted by frequency, so prefixes are the most asked problems
+    for name in periods:
+        if name == 'all.csv':
+            subset = rows
+        elif name == 'more-than-six-months.csv':
+            subset = rows[int(len(rows) * PERIOD_SHARES['six-months.csv']):]
+        else:
+            subset = rows[:max(1, int(len(rows) * PERIOD_SHARES[name]))]
+        with open(folder / name, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            writer.writerows(subset)
+
+
+def generate(output: str, companies: int, problems: int, per_company: int,
+             overlap: float, periods: list, seed: int) -> dict:
+    rng = random.Random(seed)
+    root = Path(output)
+    if root.exists():
+        shutil.rmtree(root)
+    root.mkdir(parents=True)
+
+    catalog = build_catalog(rng, problems)
+    popular = catalog[:max(1, problems // 10)]
+    picks = 0
+
+    for c in range(companies):
+        # With overlap 1 every draw is popular, so at most that many are distinct
+        available = len(popular) if overlap >= 1 else problems
+        count = max(1, min(available, int(rng.gauss(per_company, per_company / 3))))
+        picked = {}
+        while len(picked) < count:
+            problem = rng.choice(popular) if rng.random() < overlap else rng.choice(catalog)
+            picked[problem[0]] = problem
+
+        frequencies = sorted((rng.uniform(0, 100) for _ in picked), reverse=True)
+        rows = [
+            (*problem, f"{frequency:.1f}%")
+            for problem, frequency in zip(picked.values(), frequencies)
+        ]
+        write_company(root / f"company-{c:05d}", rows, periods)
+        picks += len(rows)
+
+    return {
+        'companies': companies,
+        'problems': problems,
+        'rows_per_company': per_company,
+        'overlap': overlap,
+        'periods': len(periods),
+        'company_problems': picks,
+        'seed': seed
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic company-wise problem dataset")
+    parser.add_argument('--output', required=True, help='Folder to create (replaced if it exists)')
+    parser.add_argument('--companies', type=int, default=1000)
+    parser.add_argument('--problems', type=int, default=5000, help='Size of the shared problem catalog')
+    parser.add_argument('--rows-per-company', type=int, default=60, help='Average problems per company')
+    parser.add_argument('--overlap', type=float, default=0.5,
+                        help='Share of draws from the most popular tenth of the catalog (0-1)')
+    parser.add_argument('--periods', nargs='+', default=PERIOD_FILES, choices=PERIOD_FILES,
+                        help='Time period files to write per company')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    info = generate(args.output, args.companies, args.problems, args.rows_per_company,
+                    args.overlap, args.periods, args.seed)
+    print(f"✅ Wrote {info['companies']} companies ({info['company_problems']} company problems, "
+          f"{info['periods']} files each) to {args.output}")
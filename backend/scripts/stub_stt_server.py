@@ -0,0 +1,138 @@
+"""
+Stub Streaming STT Server
+=========================
+Local stand-in for the Deepgram live transcription WebSocket, for testing the
+interview engine's server-side speech-to-text without a Deepgram account.
+
+It accepts linear16 mono PCM frames and runs a simple energy-based endpointer.
+When speech is followed by enough silence, it replies with Deepgram-shaped
+`Results` messages (`is_final` / `speech_final`) and an `UtteranceEnd`. The
+transcripts come from a script file, one line per utterance, or describe the
+detected audio if no script is given. `KeepAlive` and `CloseStream` control
+messages are honoured.
+
+Usage:
+    python stub_stt_server.py --port 8766 --script utterances.txt
+
+Then run the engine with:
+    STT_URL=ws://localhost:8766/v1/listen python services/interview_engine.py
+"""
+
+import json
+import asyncio
+import argparse
+from array import array
+from itertools import cycle
+from typing import Iterator, Optional
+
+import websockets
+
+
+class Endpointer:
+    """Energy-based voice activity detection over 16-bit PCM"""
+
+    def __init__(self, sample_rate: int, threshold: int, silence_ms: int):
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.silence_samples = sample_rate * silence_ms // 1000
+        self.speech_samples = 0
+        self.trailing_silence = 0
+        self._carry = b""
+
+    def feed(self, frame: bytes) -> bool:
+        """Consume a frame; True when an utterance just ended"""
+        data = self._carry + frame
+        usable = len(data) - len(data) % 2
+        self._carry = data[usable:]
+        samples = array('h', data[:usable])
+        if not samples:
+            return False
+
+        energy = sum(s * s for s in samples) / len(samples)
+        if energy >= self.threshold * self.threshold:
+            self.speech_samples += len(samples)
+            self.trailing_silence = 0
+            return False
+
+        if self.speech_samples:
+            self.trailing_silence += len(samples)
+            if self.trailing_silence >= self.silence_samples:
+                return True
+        return False
+
+    def reset(self) -> float:
+        """Start a new utterance; returns the duration of the finished one"""
+        duration = self.speech_samples / self.sample_rate
+        self.speech_samples = 0
+        self.trailing_silence = 0
+        return duration
+
+
+def results_message(transcript: str, duration: float, start: float) -> str:
+    return json.dumps({
+        'type': 'Results',
+        'start': start,
+        'duration': duration,
+        'is_final': True,
+        'speech_final': True,
+        'channel': {'alternatives': [{'transcript': transcript, 'confidence': 0.99}]}
+    })
+
+
+async def handle_stream(websocket, args, transcripts: Optional[Iterator[str]]):
+    endpointer = Endpointer(args.sample_rate, args.threshold, args.silence_ms)
+    elapsed = 0.0
+    utterance = 0
+
+    async def finish_utterance():
+        nonlocal elapsed, utterance
+        duration = endpointer.reset()
+        if duration <= 0:
+            return
+        utterance += 1
+        text = next(transcripts) if transcripts else f"utterance {utterance} lasting {duration:.1f} seconds"
+        await websocket.send(results_message(text, duration, elapsed))
+        await websocket.send(json.dumps({'type': 'UtteranceEnd', 'last_word_end': elapsed}))
+        elapsed += duration
+
+    async for message in websocket:
+        if isinstance(message, str):
+            control = json.loads(message)
+            if control.get('type') == 'CloseStream':
+                await finish_utterance()
+                break
+            continue  # KeepAlive
+
+        if endpointer.feed(message):
+            await finish_utterance()
+
+    await websocket.close()
+
+
+async def main(args):
+    transcripts = None
+    if args.script:
+        with open(args.script, 'r') as f:
+            lines = [line.strip() for line in f if line.strip()]
+        transcripts = cycle(lines) if lines else None
+
+    async with websockets.serve(
+        lambda ws: handle_stream(ws, args, transcripts),
+        args.host,
+        args.port,
+        max_size=None
+    ):
+        print(f"🎙️  Stub STT server listening on ws://{args.host}:{args.port}")
+        await asyncio.Future()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub streaming STT server for local testing")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--sample-rate', type=int, default=16000)
+    parser.add_argument('--threshold', type=int, default=500, help='RMS amplitude counted as speech')
+    parser.add_argument('--silence-ms', type=int, default=300, help='Trailing silence that ends an utterance')
+    parser.add_argument('--script', help='File with one transcript per line, returned in order')
+
+    asyncio.run(main(parser.parse_args()))
@@ -336,6 +336,47 @@ app.get('/api/problems', async (req, res) => {
   }
 });
 
+// Problem statistics (from the trigger-maintained stats tables, no table scans)
+app.get('/api/problems/stats', async (req, res) => {
+  try {
+    const { period = 'all_time' } = req.query;
+
+    const [difficulties, companies] = await Promise.all([
+      pool.query(`
+        SELECT difficulty, problems FROM problem_stats WHERE problems > 0
+      `),
+      pool.query(`
+        SELECT company_slug, company_name, problems
+        FROM company_problem_stats
+        WHERE time_period = $1 AND problems > 0
+        ORDER BY problems DESC
+      `, [period])
+    ]);
+
+    const byDifficulty = {};
+    let total = 0;
+    for (const row of difficulties.rows) {
+      byDifficulty[row.difficulty.toLowerCase()] = row.problems;
+      total += row.problems;
+    }
+
+    res.json({
+      total,
+      byDifficulty,
+      period,
+      companies: companies.rows.length,
+      topCompanies: companies.rows.slice(0, 10).map(row => ({
+        slug: row.company_slug,
+        name: row.company_name,
+        problems: row.problems
+      }))
+    });
+  } catch (error) {
+    console.error('Problem stats fetch error:', error);
+    res.status(500).json({ error: 'Failed to fetch problem stats' });
+  }
+});
+
 // Companies API
 app.get('/api/companies', async (req, res) => {
   try {
@@ -0,0 +1,85 @@
+"""Checks for the problem ingestion script on a small synthetic dataset"""
+
+import os
+import sys
+import uuid
+from dataclasses import astuple
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services'))
+
+from generate_synthetic_dataset import PERIOD_FILES, generate  # noqa: E402
+from ingest_problems import DIFFICULTY_CODES, ProblemIngester, write_snapshot  # noqa: E402
+from interview_engine import ProblemSnapshot, RecommendationIndex  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def questions_dir(tmp_path_factory):
+    root = tmp_path_factory.mktemp("questions")
+    generate(str(root), companies=24, problems=80, per_company=12, overlap=0.6, periods=PERIOD_FILES, seed=3)
+    # One unparseable row and one file without the required columns
+    with open(root / "company-00003" / "all.csv", "a", encoding="utf-8") as f:
+        f.write("not-a-number,https://leetcode.com/problems/x,X,Easy,50.0%,10.0%\n")
+    (root / "company-00007" / "thirty-days.csv").write_text("Title,Difficulty\nTwo Sum,Easy\n", encoding="utf-8")
+    return root
+
+
+def scan(questions_dir, workers: int) -> ProblemIngester:
+    ingester = ProblemIngester(str(questions_dir), db_url=None)
+    ingester.scan_companies(workers=workers)
+    return ingester
+
+
+def test_parallel_scan_matches_serial_scan(questions_dir):
+    serial = scan(questions_dir, workers=1)
+    parallel = scan(questions_dir, workers=3)
+
+    assert [astuple(p) for p in parallel.problems.values()] == [astuple(p) for p in serial.problems.values()]
+    assert [astuple(cp) for cp in parallel.company_problems] == [astuple(cp) for cp in serial.company_problems]
+    assert astuple(parallel.report) == astuple(serial.report)
+    assert serial.report.skipped_rows == 1 and serial.report.rejected_files == 1
+
+
+def test_snapshot_round_trip(questions_dir, tmp_path):
+    ingester = scan(questions_dir, workers=1)
+    problems = sorted(ingester.problems.values(), key=lambda p: p.leetcode_id)
+    # Ids for every other problem, as if only part of the catalog were loaded
+    problem_ids = {p.leetcode_id: str(uuid.uuid4()) for p in problems[::2]}
+    path = str(tmp_path / "problems.snap")
+    write_snapshot(ingester, path, problem_ids)
+    
+    snapshot = ProblemSnapshot(path)
+    assert snapshot.problem_count == len(problems)
+    for n, p in enumerate(problems):
+        assert snapshot.leetcode_id[n] == p.leetcode_id
+        assert snapshot.string(snapshot.title[n]) == p.title
+        assert snapshot.string(snapshot.slug[n]) == p.slug
+        assert snapshot.string(snapshot.url[n]) == p.url
+        assert snapshot.frequency[n] == pytest.approx(p.frequency, rel=1e-6)
+        assert snapshot.acceptance[n] == pytest.approx(p.acceptance_rate, rel=1e-6)
+        assert snapshot.difficulty[n] == DIFFICULTY_CODES[p.difficulty]
+        assert snapshot.problem_id(n) == problem_ids.get(p.leetcode_id)
+    
+    # Rankings hold each problem once at its highest frequency, most frequent first
+    expected = {}
+    for cp in ingester.company_problems:
+        ranking = expected.setdefault((cp.company_slug, cp.time_period), {})
+        ranking[cp.problem_id] = max(ranking.get(cp.problem_id, cp.frequency), cp.frequency)
+    index = RecommendationIndex.from_snapshot(snapshot)
+    assert set(index.rankings) == set(expected)
+    for key, (ranked, frequencies) in index.rankings.items():
+        ordered = sorted(expected[key].items(), key=lambda item: (-item[1], item[0]))
+        assert [snapshot.leetcode_id[n] for n in ranked] == [leetcode_id for leetcode_id, _ in ordered]
+        assert list(frequencies) == pytest.approx([frequency for _, frequency in ordered])
+    assert index.source == 'snapshot'
+
+
+def test_snapshot_without_ids(questions_dir, tmp_path):
+    path = str(tmp_path / "problems.snap")
+    write_snapshot(scan(questions_dir, workers=1), path)
+    
+    index = RecommendationIndex.from_snapshot(ProblemSnapshot(path))
+    assert all(problem_id is None for problem_id in index.ids)
+    assert index.source == 'snapshot (no ids)' and not index.has_ids
@@ -0,0 +1,197 @@
+"""Unit checks for the interview engine's local state handling"""
+
+import asyncio
+import os
+import sys
+
+import numpy as np
+import pytest
+from pydantic import BaseModel
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services'))
+
+from interview_engine import (  # noqa: E402
+    FastPathConfig,
+    InterviewPhase,
+    InterviewMetrics,
+    InterviewSession,
+    MessageRole,
+    SESSION_TOKEN_SOFT_BUDGET,
+    SessionManager,
+    UtteranceClassifier,
+    UtteranceIntent,
+    WeightProfile,
+    _METRIC_COLUMNS,
+    read_checkpoint,
+    score_metrics,
+    score_metrics_batch,
+    speculative_turn_for,
+    write_checkpoint,
+)
+
+PROBLEM = {'id': 'p-1', 'title': 'Two Sum', 'difficulty': 'easy', 'examples': [], 'test_cases': []}
+
+
+@pytest.fixture
+def classifier():
+    return UtteranceClassifier(FastPathConfig())
+
+
+@pytest.mark.parametrize("text", [
+    "hmm let me see",
+    "let me think about this",
+    "um, give me a second",
+    "uh let me think for a moment",
+    "well hmm",
+])
+def test_filler_is_thinking_aloud(classifier, text):
+    assert classifier.classify(text, InterviewPhase.CODING) == UtteranceIntent.THINKING_ALOUD
+
+
+@pytest.mark.parametrize("text", [
+    "so I finished it",
+    "hmm I am done",
+    "hmm wrong answer",
+    "let me think, use a heap",
+    "so i would use a hash map",
+])
+def test_content_after_filler_is_substantive(classifier, text):
+    assert classifier.classify(text, InterviewPhase.CODING) == UtteranceIntent.SUBSTANTIVE
+
+
+@pytest.mark.parametrize("text, phase", [
+    ("I'm done", InterviewPhase.CODING),
+    ("okay, I think I'm done", InterviewPhase.CODING),
+    ("that should work", InterviewPhase.CODING),
+    ("all the tests pass", InterviewPhase.TESTING),
+    ("looks good, all tests pass", InterviewPhase.TESTING),
+    ("I think this is optimal", InterviewPhase.OPTIMIZATION),
+])
+def test_predicted_turn_matches(text, phase):
+    assert speculative_turn_for(text, phase) is not None
+
+
+@pytest.mark.parametrize("text, phase", [
+    ("two cases passed but the third one fails", InterviewPhase.TESTING),
+    ("the first test fails, the rest pass", InterviewPhase.TESTING),
+    ("one test fails", InterviewPhase.TESTING),
+    ("it doesn't work", InterviewPhase.TESTING),
+    ("I finished the loop but the helper is broken", InterviewPhase.CODING),
+    ("done, but there's a bug", InterviewPhase.CODING),
+    ("I'm not done yet", InterviewPhase.CODING),
+    ("I doubt it is optimal", InterviewPhase.OPTIMIZATION),
+    ("is a heap optimal here", InterviewPhase.OPTIMIZATION),
+    ("okay is this optimal", InterviewPhase.OPTIMIZATION),
+    ("is it done?", InterviewPhase.CODING),
+    ("so I think I'm done with the whole thing now", InterviewPhase.CODING),
+    ("done", InterviewPhase.INTRO),
+])
+def test_other_turns_do_not_match(text, phase):
+    assert speculative_turn_for(text, phase) is None
+
+
+def test_checkpoint_round_trip(tmp_path):
+    session = InterviewSession("s-1", "c-1", PROBLEM, job_id="j-1", session_type="assessment")
+    session.messages.append(MessageRole.INTERVIEWER, "Hi! Let's start.", metadata={'phase_change': 'intro'})
+    session.messages.append(MessageRole.CANDIDATE, "Use a hash map — O(n) ✓")
+    session.messages.append(MessageRole.INTERVIEWER, "", metadata={'hint': None})
+    session.proctoring_events.append("tab_switch", {'count': 1})
+    session.proctoring_events.append("focus_regained")
+    session.proctoring_events.append("tab_switch", {'count': 2})
+    
+    path = str(tmp_path / "s-1.ckpt")
+    write_checkpoint(path, session.to_checkpoint())
+    restored = InterviewSession.from_checkpoint(read_checkpoint(path))
+    
+    assert list(restored.messages) == list(session.messages)
+    assert restored.messages.last_content(MessageRole.CANDIDATE) == "Use a hash map — O(n) ✓"
+    assert restored.proctoring_events.as_dicts() == session.proctoring_events.as_dicts()
+    
+    # Both logs keep growing after a restore
+    restored.messages.append(MessageRole.CANDIDATE, "done")
+    restored.proctoring_events.append("copy_paste")
+    assert restored.messages[-1].content == "done"
+    assert restored.messages[1].content == "Use a hash map — O(n) ✓"
+    assert [event['type'] for event in restored.proctoring_events][-1] == "copy_paste"
+
+
+def test_checkpoint_is_restored_by_one_worker(tmp_path):
+    writer = SessionManager(str(tmp_path))
+    writer.discover_checkpoints()
+    writer.sessions["s-3"] = InterviewSession("s-3", "c-1", PROBLEM)
+    asyncio.run(writer.checkpoint_sessions())
+    
+    workers = [SessionManager(str(tmp_path)) for _ in range(2)]
+    for worker in workers:
+        worker.discover_checkpoints()
+    restored = [worker.get_session("s-3") for worker in workers]
+    assert sum(session is not None for session in restored) == 1
+    assert len(list(tmp_path.glob("s-3.*.ckpt"))) == 1
+
+
+def test_batch_scores_match_single_scores():
+    profiles = [
+        WeightProfile(),
+        WeightProfile.from_dict({
+            'technical': 0.7, 'behavioral': 0.1, 'communication': 0.1, 'code_quality': 0.1,
+            'technical_weights': {'correctness_score': 0.8, 'edge_cases_score': 0.2},
+            'cheating_threshold': 30, 'cheating_multiplier': 1.5
+        }),
+    ]
+    profiles += [profile.for_assessment() for profile in profiles]
+    rng = np.random.default_rng(7)
+    metrics = rng.uniform(0, 100, size=(200, len(_METRIC_COLUMNS)))
+    profile_index = rng.integers(0, len(profiles), size=200)
+    
+    batch = score_metrics_batch(metrics, profile_index, profiles)
+    for row, p in zip(range(200), profile_index):
+        single = score_metrics(InterviewMetrics(**dict(zip(_METRIC_COLUMNS, metrics[row]))), profiles[p])
+        for name, value in single.items():
+            assert batch[name][row] == pytest.approx(value)
+
+
+def test_checkpoint_keeps_weight_profile():
+    session = InterviewSession("s-2", "c-1", PROBLEM, job_id="j-1")
+    session.weight_profile = WeightProfile.from_dict({'technical': 0.9, 'cheating_threshold': 20})
+    restored = InterviewSession.from_checkpoint(session.to_checkpoint())
+    assert restored.weight_profile == session.weight_profile
+
+
+def test_assessment_total_ignores_conversation():
+    profile = WeightProfile.from_dict({'technical': 0.5, 'code_quality': 0.3})
+    metrics = InterviewMetrics(correctness_score=80, time_complexity_score=70, code_readability_score=90)
+    single = score_metrics(metrics, profile)
+    expected = (single['technical'] * 0.5 + single['code_quality'] * 0.3) / 0.8
+    assert score_metrics(metrics, profile.for_assessment())['total'] == pytest.approx(expected)
+
+
+class _Reply:
+    def __init__(self, text, prompt_tokens):
+        self.text = text
+        self.usage_metadata = type('Usage', (), {'prompt_token_count': prompt_tokens, 'candidates_token_count': 1})()
+
+
+class _Chat:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.sent = []
+
+    def send_message(self, message, generation_config=None):
+        self.sent.append(message)
+        return self.replies.pop(0)
+
+
+class _Verdict(BaseModel):
+    ok: bool
+
+
+def test_repair_retry_runs_before_history_trim():
+    session = InterviewSession("s-4", "c-1", PROBLEM)
+    chat = _Chat([_Reply("not json", SESSION_TOKEN_SOFT_BUDGET), _Reply('{"ok": true}', 10)])
+    session.chat = chat
+    
+    result = asyncio.run(session._request_structured("verdict?", _Verdict, kind="analysis"))
+    
+    assert result.ok
+    assert session.chat is chat and len(chat.sent) == 2
+    assert session._chat_pending_restore  # Trimmed on the next request instead